@@ -1,10 +1,12 @@
+import threading
+
 import dbus
 import dbus.mainloop.glib
 from gi.repository import GLib
-from FindMeServer import (
-    BLUEZ_SERVICE_NAME, ADAPTER_IFACE, GATT_MANAGER_IFACE,
-    ADVERTISING_MANAGER_IFACE, Application, IASService,Advertisement, find_adapter
+from constants import (
+    BLUEZ_SERVICE_NAME, ADAPTER_IFACE, GATT_MANAGER_IFACE, ADVERTISING_MANAGER_IFACE
 )
+from FindMeServer import Application, IASService, Advertisement, find_adapter
 
 def main():
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
@@ -15,33 +17,36 @@ def main():
         print(" No Bluetooth adapter found.")
         return
 
-    adapter = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path), ADAPTER_IFACE)
-    adapter_props = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path),
-                                   'org.freedesktop.DBus.Properties')
+    # One proxy serves every adapter interface, so it is introspected only once
+    adapter_obj = bus.get_object(BLUEZ_SERVICE_NAME, adapter_path)
+    adapter_props = dbus.Interface(adapter_obj, 'org.freedesktop.DBus.Properties')
     adapter_props.Set(ADAPTER_IFACE, 'Powered', dbus.Boolean(1))
 
-    # GATT application 
-    service_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path),
-                                     GATT_MANAGER_IFACE)
     app = Application(bus)
     ias_service = IASService(bus, 0)
     app.add_service(ias_service)
+    advertisement = Advertisement(bus)
+
+    # GATT application and BLE advertisement are registered back to back;
+    # neither call waits for the other's reply.
+    service_manager = dbus.Interface(adapter_obj, GATT_MANAGER_IFACE)
+    ad_manager = dbus.Interface(adapter_obj, ADVERTISING_MANAGER_IFACE)
 
     service_manager.RegisterApplication(app.get_path(), {},
         reply_handler=lambda: print(" GATT application registered"),
         error_handler=lambda e: print(f" Failed to register GATT application: {e}"))
-   
-    # BLE Advertisement
-
-    ad_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path),
-                                ADVERTISING_MANAGER_IFACE)
-    advertisement = Advertisement(bus)
     ad_manager.RegisterAdvertisement(advertisement.PATH, {},
         reply_handler=lambda: print(" BLE advertisement registered"),
         error_handler=lambda e: print(f" Failed to register advertisement: {e}"))
+    # Run D-Bus dispatch on its own thread; the main thread only waits for Ctrl+C
+    loop = GLib.MainLoop()
+    loop_thread = threading.Thread(target=loop.run, daemon=True)
+    loop_thread.start()
     try:
-        GLib.MainLoop().run()
+        while loop_thread.is_alive():
+            loop_thread.join(0.5)
     except KeyboardInterrupt:
+        loop.quit()
         print("\nServer stopped by user")
 
 if __name__ == '__main__':
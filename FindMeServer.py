@@ -1,9 +1,59 @@
+import os
+
 import constants
 from gi.repository import GLib
 import dbus
-import dbus.mainloop.glib
 import dbus.service
 
+__all__ = ['Application', 'IASService', 'AlertLevelCharacteristic',
+           'Advertisement', 'find_adapter']
+
+# Alert messages indexed by the written alert level; the last entry covers
+# any level outside 0-2.
+_ALERT_MSGS = ("No Alert", "Mild Alert", "High Alert", "Unknown Alert")
+_UNKNOWN_ALERT = len(_ALERT_MSGS) - 1
+
+# Pre-encoded notification payloads, indexed like _ALERT_MSGS.
+_ALERT_VALUES = tuple(dbus.ByteArray(msg.encode('ascii')) for msg in _ALERT_MSGS)
+
+# (name, signature, EmitsChangedSignal) for properties advertised in Introspect.
+_SERVICE_PROPERTIES = (
+    ('UUID', 's', 'const'),
+    ('Primary', 'b', 'const'),
+    ('Characteristics', 'ao', 'false'),
+)
+_CHARACTERISTIC_PROPERTIES = (
+    ('UUID', 's', 'const'),
+    ('Service', 'o', 'const'),
+    ('Flags', 'as', 'const'),
+    ('Notifying', 'b', 'true'),
+)
+
+
+def _annotate_introspection(xml, interface, properties):
+    """
+    Adds annotated property elements for an interface to introspection XML.
+
+    Args:
+        xml: Introspection XML produced by dbus-python.
+        interface: Interface the properties belong to.
+        properties: Iterable of (name, signature, EmitsChangedSignal) tuples.
+
+    Returns:
+        Introspection XML including the property declarations.
+    """
+    props = ''.join(
+        f'    <property name="{name}" type="{sig}" access="read">\n'
+        f'      <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal"'
+        f' value="{emits}"/>\n'
+        f'    </property>\n'
+        for name, sig, emits in properties)
+    tag = f'<interface name="{interface}">\n'
+    if tag in xml:
+        return xml.replace(tag, tag + props, 1)
+    node_end = xml.index('>', xml.index('<node')) + 1
+    return f'{xml[:node_end]}\n  {tag}{props}  </interface>{xml[node_end:]}'
+
 
 class Application(dbus.service.Object):
     """
@@ -22,7 +72,9 @@ class Application(dbus.service.Object):
             bus: The system D-Bus connection.
         """
         self.path = self.PATH
+        self._dbus_path = dbus.ObjectPath(self.path)
         self.services = []
+        self._managed_objects_cache = None
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_path(self):
@@ -30,7 +82,7 @@ class Application(dbus.service.Object):
         Returns:
             D-Bus object path of the application.
         """
-        return dbus.ObjectPath(self.path)
+        return self._dbus_path
 
     def add_service(self, service):
         """
@@ -40,6 +92,14 @@ class Application(dbus.service.Object):
             service: The service object to be added.
         """
         self.services.append(service)
+        service.application = self
+        self.invalidate_managed_objects()
+
+    def invalidate_managed_objects(self):
+        """
+        Drops the cached GetManagedObjects reply so it is rebuilt on next call.
+        """
+        self._managed_objects_cache = None
 
     @dbus.service.method('org.freedesktop.DBus.ObjectManager',
                          out_signature='a{oa{sa{sv}}}')
@@ -48,12 +108,14 @@ class Application(dbus.service.Object):
         Returns:
             Dict of all managed D-Bus objects and their properties.
         """
-        response = {}
-        for service in self.services:
-            response[service.get_path()] = service.get_properties()
-            for char in service.get_characteristics():
-                response[char.get_path()] = char.get_properties()
-        return response
+        if self._managed_objects_cache is None:
+            response = {}
+            for service in self.services:
+                response[service.get_path()] = service.get_properties()
+                for char in service.get_characteristics():
+                    response[char.get_path()] = char.get_properties()
+            self._managed_objects_cache = response
+        return self._managed_objects_cache
 
 
 class IASService(dbus.service.Object):
@@ -70,10 +132,20 @@ class IASService(dbus.service.Object):
             index: Index used in object path.
         """
         self.path = f'/org/bluez/example/service{index}'
+        self._dbus_path = dbus.ObjectPath(self.path)
         self.bus = bus
-        self.uuid = constants.IAS_UUID
+        self.uuid = constants.IAS_UUID_DBUS
         self.primary = True
         self.characteristics = []
+        self.application = None
+        self._char_paths = dbus.Array([], signature='o')
+        self._cached_properties = {
+            constants.GATT_SERVICE_IFACE: {
+                'UUID': self.uuid,
+                'Primary': dbus.Boolean(self.primary),
+                'Characteristics': self._char_paths
+            }
+        }
         dbus.service.Object.__init__(self, bus, self.path)
 
         self.alert_level_char = AlertLevelCharacteristic(bus, 0, self)
@@ -84,22 +156,26 @@ class IASService(dbus.service.Object):
         Returns:
             D-Bus object path of the service.
         """
-        return dbus.ObjectPath(self.path)
+        return self._dbus_path
 
     def get_properties(self):
         """
         Returns:
             Dictionary of GATT service properties.
         """
-        return {
-            constants.GATT_SERVICE_IFACE: {
-                'UUID': self.uuid,
-                'Primary': self.primary,
-                'Characteristics': dbus.Array(
-                    [char.get_path() for char in self.characteristics],
-                    signature='o')
-            }
-        }
+        return self._cached_properties
+
+    @dbus.service.method('org.freedesktop.DBus.Introspectable',
+                         in_signature='', out_signature='s',
+                         path_keyword='object_path', connection_keyword='connection')
+    def Introspect(self, object_path, connection):
+        """
+        Returns:
+            Introspection XML including annotated service properties.
+        """
+        xml = dbus.service.Object.Introspect(self, object_path, connection)
+        return _annotate_introspection(xml, constants.GATT_SERVICE_IFACE,
+                                       _SERVICE_PROPERTIES)
 
     def add_characteristic(self, char):
         """
@@ -109,6 +185,12 @@ class IASService(dbus.service.Object):
             char: The characteristic object.
         """
         self.characteristics.append(char)
+        self._char_paths = dbus.Array(
+            [c.get_path() for c in self.characteristics], signature='o')
+        service_props = self._cached_properties[constants.GATT_SERVICE_IFACE]
+        service_props['Characteristics'] = self._char_paths
+        if self.application is not None:
+            self.application.invalidate_managed_objects()
 
     def get_characteristics(self):
         """
@@ -135,11 +217,22 @@ class AlertLevelCharacteristic(dbus.service.Object):
             service: The parent service object.
         """
         self.path = f'{service.get_path()}/char{index}'
+        self._dbus_path = dbus.ObjectPath(self.path)
         self.bus = bus
         self.service = service
-        self.uuid = constants.ALERT_LEVEL_UUID
-        self.flags = ['write-without-response', 'notify']
+        self.uuid = constants.ALERT_LEVEL_UUID_DBUS
+        self.flags = constants.ALERT_FLAGS_DBUS
         self.notifying = False
+        self._pending_alert = None
+        self._emit_scheduled = False
+        self._cached_properties = {
+            constants.GATT_CHARACTERISTIC_IFACE: {
+                'UUID': self.uuid,
+                'Service': self.service.get_path(),
+                'Flags': self.flags,
+                'Notifying': dbus.Boolean(self.notifying)
+            }
+        }
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_path(self):
@@ -147,47 +240,62 @@ class AlertLevelCharacteristic(dbus.service.Object):
         Returns:
             D-Bus object path of the characteristic.
         """
-        return dbus.ObjectPath(self.path)
+        return self._dbus_path
 
     def get_properties(self):
         """
         Returns:
             Dictionary of GATT characteristic properties.
         """
-        return {
-            constants.GATT_CHARACTERISTIC_IFACE: {
-                'UUID': self.uuid,
-                'Service': self.service.get_path(),
-                'Flags': dbus.Array(self.flags, signature='s'),
-                'Notifying': dbus.Boolean(self.notifying)
-            }
-        }
+        return self._cached_properties
+
+    @dbus.service.method('org.freedesktop.DBus.Introspectable',
+                         in_signature='', out_signature='s',
+                         path_keyword='object_path', connection_keyword='connection')
+    def Introspect(self, object_path, connection):
+        """
+        Returns:
+            Introspection XML including annotated characteristic properties.
+        """
+        xml = dbus.service.Object.Introspect(self, object_path, connection)
+        return _annotate_introspection(xml, constants.GATT_CHARACTERISTIC_IFACE,
+                                       _CHARACTERISTIC_PROPERTIES)
 
     @dbus.service.method(constants.GATT_CHARACTERISTIC_IFACE,
-                         in_signature='aya{sv}', out_signature='')
+                         in_signature='aya{sv}', out_signature='',
+                         byte_arrays=True)
     def WriteValue(self, value, options):
         """
         Handles write requests from clients.
 
+        The alert is processed from a main loop idle callback so the
+        method call returns without waiting on logging or notification.
+
         Args:
-            value: Byte array of the written value.
+            value: Written value, delivered as a dbus.ByteArray (bytes).
             options: Additional write options (unused).
         """
         if not value:
             print("[AlertLevelCharacteristic] Received empty value")
             return
 
-        level = int(value[0])
-        msg = "Unknown Alert"
-        if level == 0:
-            msg = "No Alert"
-        elif level == 1:
-            msg = "Mild Alert"
-        elif level == 2:
-            msg = "High Alert"
+        GLib.idle_add(self._handle_alert, value[0])
+
+    def _handle_alert(self, level):
+        """
+        Reports a written alert level and notifies subscribed clients.
+
+        Args:
+            level: Alert level byte written by the client.
+
+        Returns:
+            False, so the idle source is removed after one run.
+        """
+        alert = level if 0 <= level < _UNKNOWN_ALERT else _UNKNOWN_ALERT
 
-        print(f"[AlertLevelCharacteristic] Received alert level: {msg}")
-        self.send_notification(msg)
+        print(f"[AlertLevelCharacteristic] Received alert level: {_ALERT_MSGS[alert]}")
+        self.send_notification(alert)
+        return False
 
     @dbus.service.method(constants.GATT_CHARACTERISTIC_IFACE,
                          in_signature='', out_signature='')
@@ -195,7 +303,7 @@ class AlertLevelCharacteristic(dbus.service.Object):
         """
         Starts notifications when a client subscribes.
         """
-        self.notifying = True
+        self._set_notifying(True)
         print("[AlertLevelCharacteristic] Notifications enabled")
 
     @dbus.service.method(constants.GATT_CHARACTERISTIC_IFACE,
@@ -204,22 +312,55 @@ class AlertLevelCharacteristic(dbus.service.Object):
         """
         Stops notifications when a client unsubscribes.
         """
-        self.notifying = False
+        self._set_notifying(False)
         print("[AlertLevelCharacteristic] Notifications disabled")
 
-    def send_notification(self, message):
+    def _set_notifying(self, notifying):
         """
-        Sends a notification to subscribed clients.
+        Updates the Notifying property and signals the change.
 
         Args:
-            message: The alert message string to send.
+            notifying: New notification state.
+        """
+        self.notifying = notifying
+        value = dbus.Boolean(notifying)
+        self._cached_properties[constants.GATT_CHARACTERISTIC_IFACE]['Notifying'] = value
+        self.PropertiesChanged(constants.GATT_CHARACTERISTIC_IFACE,
+                               {'Notifying': value}, [])
+
+    def send_notification(self, alert):
+        """
+        Queues a notification to subscribed clients.
+
+        Notifications requested before the main loop goes idle are
+        coalesced, so only the most recent alert is emitted.
+
+        Args:
+            alert: Index into the alert messages of the alert to send.
         """
         if not self.notifying:
             print("[AlertLevelCharacteristic] Notification skipped (not notifying)")
             return
-        value = [dbus.Byte(ord(c)) for c in message]
+        self._pending_alert = alert
+        if not self._emit_scheduled:
+            self._emit_scheduled = True
+            GLib.idle_add(self._flush_notification)
+
+    def _flush_notification(self):
+        """
+        Emits the pending notification from the main loop idle callback.
+
+        Returns:
+            False, so the idle source is removed after one run.
+        """
+        alert = self._pending_alert
+        self._pending_alert = None
+        self._emit_scheduled = False
+        if alert is None or not self.notifying:
+            return False
         self.PropertiesChanged(constants.GATT_CHARACTERISTIC_IFACE,
-                               {'Value': dbus.Array(value, signature='y')}, [])
+                               {'Value': _ALERT_VALUES[alert]}, [])
+        return False
 
     @dbus.service.signal('org.freedesktop.DBus.Properties',
                          signature='sa{sv}as')
@@ -250,6 +391,12 @@ class Advertisement(dbus.service.Object):
             bus: The system D-Bus connection.
         """
         self.bus = bus
+        self._cached_properties = {
+            'Type': 'peripheral',
+            'ServiceUUIDs': constants.SERVICE_UUIDS_DBUS,
+            'LocalName': 'FindMeServer',
+            'IncludeTxPower': dbus.Boolean(True)
+        }
         dbus.service.Object.__init__(self, bus, self.PATH)
 
     @dbus.service.method('org.freedesktop.DBus.Properties',
@@ -264,12 +411,7 @@ class Advertisement(dbus.service.Object):
         Returns:
             Dictionary of advertisement properties.
         """
-        return {
-            'Type': 'peripheral',
-            'ServiceUUIDs': dbus.Array([constants.IAS_UUID], signature='s'),
-            'LocalName': 'FindMeServer',
-            'IncludeTxPower': dbus.Boolean(True)
-        }
+        return self._cached_properties
 
     @dbus.service.method(constants.LE_ADVERTISEMENT_IFACE,
                          in_signature='', out_signature='')
@@ -280,21 +422,185 @@ class Advertisement(dbus.service.Object):
         print("Advertisement released")
 
 
+class _AdapterCache:
+    """
+    Caches the adapter path so lookups avoid repeated BlueZ round trips.
+
+    The path is resolved once, by probing the adapter directly or, failing
+    that, with a single GetManagedObjects scan, and is then kept current
+    through the InterfacesAdded and InterfacesRemoved signals.
+    """
+
+    def __init__(self):
+        self._bus = None
+        self._name = None
+        self._objects = {}
+        self._complete = False
+        self._adapter_path = None
+
+    def _subscribe(self, bus):
+        """
+        Subscribes to object manager signals on a bus.
+
+        Args:
+            bus: The system D-Bus connection.
+        """
+        bus.add_signal_receiver(self._on_added,
+                                signal_name='InterfacesAdded',
+                                dbus_interface='org.freedesktop.DBus.ObjectManager',
+                                bus_name=constants.BLUEZ_SERVICE_NAME,
+                                path='/')
+        bus.add_signal_receiver(self._on_removed,
+                                signal_name='InterfacesRemoved',
+                                dbus_interface='org.freedesktop.DBus.ObjectManager',
+                                bus_name=constants.BLUEZ_SERVICE_NAME,
+                                path='/')
+        self._bus = bus
+
+    def _reset(self, name):
+        """
+        Forgets all cached state.
+
+        Args:
+            name: Adapter name to require from now on, or None for any.
+        """
+        self._name = name
+        self._objects = {}
+        self._complete = False
+        self._adapter_path = None
+
+    def _populate(self, bus):
+        """
+        Fills the cache from a full GetManagedObjects scan.
+
+        Args:
+            bus: The system D-Bus connection.
+        """
+        manager = dbus.Interface(bus.get_object(constants.BLUEZ_SERVICE_NAME, '/'),
+                                 'org.freedesktop.DBus.ObjectManager')
+        self._objects = {path: set(interfaces)
+                         for path, interfaces in manager.GetManagedObjects().items()}
+        self._complete = True
+        self._adapter_path = self._scan()
+
+    def _scan(self):
+        """
+        Returns:
+            Path of the first cached object implementing the adapter interface.
+        """
+        return next(
+            (path for path, interfaces in self._objects.items()
+             if constants.ADAPTER_IFACE in interfaces),
+            None,
+        )
+
+    def _accepts(self, path):
+        """
+        Args:
+            path: Object path of an adapter.
+
+        Returns:
+            True if the adapter may be used under the configured name.
+        """
+        return self._name is None or path == f'/org/bluez/{self._name}'
+
+    def _on_added(self, path, interfaces):
+        """
+        Handles the InterfacesAdded signal.
+
+        Args:
+            path: Object path that gained interfaces.
+            interfaces: Dict of added interfaces and their properties.
+        """
+        self._objects.setdefault(path, set()).update(interfaces)
+        if (self._adapter_path is None and constants.ADAPTER_IFACE in interfaces
+                and self._accepts(path)):
+            self._adapter_path = path
+
+    def _on_removed(self, path, interfaces):
+        """
+        Handles the InterfacesRemoved signal.
+
+        Args:
+            path: Object path that lost interfaces.
+            interfaces: List of removed interface names.
+        """
+        remaining = self._objects.get(path)
+        if remaining is not None:
+            remaining.difference_update(interfaces)
+            if not remaining:
+                del self._objects[path]
+        if path == self._adapter_path and constants.ADAPTER_IFACE in interfaces:
+            self._adapter_path = self._scan() if self._name is None else None
+
+    def find_adapter(self, bus, name=None):
+        """
+        Returns the cached adapter path, resolving it on first use.
+
+        Args:
+            bus: The system D-Bus connection.
+            name: Adapter name to require, or None to accept any adapter.
+
+        Returns:
+            D-Bus object path of the adapter, or None if not found.
+        """
+        if self._bus is not bus:
+            self._subscribe(bus)
+            self._reset(name)
+        elif self._name != name:
+            self._reset(name)
+        if self._adapter_path is not None:
+            return self._adapter_path
+        if self._complete and name is None:
+            # The full tree is cached and tracked, so there is no adapter
+            return None
+
+        path = _probe_adapter(bus, name or 'hci0')
+        if path is not None:
+            self._objects.setdefault(path, set()).add(constants.ADAPTER_IFACE)
+            self._adapter_path = path
+        elif name is None:
+            self._populate(bus)
+        return self._adapter_path
+
+
+_adapter_cache = _AdapterCache()
+
+
+def _probe_adapter(bus, name):
+    """
+    Checks whether the named adapter exists without walking the BlueZ tree.
+
+    Args:
+        bus: The system D-Bus connection.
+        name: Adapter name, e.g. 'hci0'.
+
+    Returns:
+        D-Bus object path of the adapter, or None if it is not present.
+    """
+    path = f'/org/bluez/{name}'
+    try:
+        obj = bus.get_object(constants.BLUEZ_SERVICE_NAME, path, introspect=False)
+        props = dbus.Interface(obj, 'org.freedesktop.DBus.Properties')
+        props.GetAll(constants.ADAPTER_IFACE)
+    except dbus.exceptions.DBusException:
+        return None
+    return path
+
+
 def find_adapter(bus):
     """
     Finds the first available Bluetooth adapter on the system.
 
+    If the BLUEZ_ADAPTER environment variable is set, only that adapter is
+    accepted. Otherwise 'hci0' is queried directly, and the BlueZ object
+    tree is only fetched if it is missing. The result is cached and kept
+    current by ObjectManager signals, so later calls make no bus calls.
+
     Args:
         bus: The system D-Bus connection.
 
     Returns:
         D-Bus object path of the adapter, or None if not found.
     """
-    manager = dbus.Interface(bus.get_object(constants.BLUEZ_SERVICE_NAME, '/'),
-                             'org.freedesktop.DBus.ObjectManager')
-    objects = manager.GetManagedObjects()
-    for path, interfaces in objects.items():
-        if constants.ADAPTER_IFACE in interfaces:
-            return path
-    return None
-
+    return _adapter_cache.find_adapter(bus, os.environ.get('BLUEZ_ADAPTER') or None)
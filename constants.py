@@ -0,0 +1,23 @@
+"""
+Shared D-Bus names and GATT UUIDs for the Find Me profile server.
+"""
+
+import dbus
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+ADAPTER_IFACE = 'org.bluez.Adapter1'
+GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
+GATT_SERVICE_IFACE = 'org.bluez.GattService1'
+GATT_CHARACTERISTIC_IFACE = 'org.bluez.GattCharacteristic1'
+ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
+LE_ADVERTISEMENT_IFACE = 'org.bluez.LEAdvertisement1'
+
+# Immediate Alert Service and its Alert Level characteristic
+IAS_UUID = '1802'
+ALERT_LEVEL_UUID = '2A06'
+
+# Pre-wrapped D-Bus values so property replies skip type inference
+IAS_UUID_DBUS = dbus.String(IAS_UUID)
+ALERT_LEVEL_UUID_DBUS = dbus.String(ALERT_LEVEL_UUID)
+ALERT_FLAGS_DBUS = dbus.Array(['write-without-response', 'notify'], signature='s')
+SERVICE_UUIDS_DBUS = dbus.Array([IAS_UUID], signature='s')